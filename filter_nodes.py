@@ -6,111 +6,143 @@ GitHub 自动节点过滤器 - 修正版
 """
 
 import requests
+import atexit
+import hashlib
+import io
+import itertools
 import os
+import queue
+import re
+from collections import Counter
 from datetime import datetime
 import logging
+from logging.handlers import QueueHandler, QueueListener
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # 配置
 SOURCE_URL = "https://raw.githubusercontent.com/Graysongon/google/refs/heads/main/%E4%B8%AA%E4%BA%BA"
 OUTPUT_FILE = "kejiland.txt"
 LOG_FILE = "filter.log"
+ETAG_FILE = ".kejiland.etag"  # 上次获取的上游 ETag，用于条件请求
 
-# 设置日志
+# fetch_nodes 在上游返回 304 时使用的哨兵值
+NOT_MODIFIED = object()
+
+# 以下正则均作用于原始字节（只需识别 ASCII 前缀），省去解码/编码的往返
+# 匹配整行（连同换行符）需要移除的节点，一次 sub 即可完成过滤
+_FILTER_RE = re.compile(
+    rb'^[ \t]*(?:http|https|socks5)=[^\r\n]*(?:\r?\n)?',
+    re.IGNORECASE | re.MULTILINE
+)
+
+# 源数据协议统计：每行取 :// 之前的部分，没有 :// 时取 = 之前的部分
+_SCHEME_RE = re.compile(rb'^([^\n]*?)://|^([^\n=]*)=', re.MULTILINE)
+
+# 保留节点分类：标准协议行捕获协议名，其他非空行捕获为空串，一次 findall 完成统计
+_PROTO_RE = re.compile(
+    rb'^[ \t]*(?:(ss|vmess|vless|trojan|ssr)://|\S)',
+    re.IGNORECASE | re.MULTILINE
+)
+
+# 复用同一会话（连接池 + 自动重试 + gzip 传输）
+_SESSION = requests.Session()
+_SESSION.headers['Accept-Encoding'] = 'gzip, deflate'
+_SESSION.mount('https://', HTTPAdapter(
+    pool_maxsize=1,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504))
+))
+
+# 设置日志：主线程只把记录放入队列，由后台线程写入文件和控制台
+_log_queue = queue.SimpleQueue()
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_FILE, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
+    handlers=[QueueHandler(_log_queue)]
+)
+_log_listener = QueueListener(
+    _log_queue,
+    logging.FileHandler(LOG_FILE, encoding='utf-8'),
+    logging.StreamHandler()
 )
+_log_listener.start()
+atexit.register(_log_listener.stop)  # 退出时写完队列中剩余的记录
 logger = logging.getLogger(__name__)
 
+def _count_lines(text):
+    """统计行数（与 splitlines() 结果一致，但不构建行列表）"""
+    line_count = text.count(b'\n')
+    if text and not text.endswith(b'\n'):
+        line_count += 1
+    return line_count
+
+def _load_etag():
+    """读取上次保存的 ETag；输出文件不存在时返回 None 以强制完整获取"""
+    if not (os.path.exists(OUTPUT_FILE) and os.path.exists(ETAG_FILE)):
+        return None
+    with open(ETAG_FILE, 'r', encoding='utf-8') as f:
+        return f.read().strip() or None
+
 def fetch_nodes():
-    """从源地址获取节点数据"""
+    """从源地址获取节点数据，返回 (内容, ETag)"""
     try:
         logger.info(f"📡 正在从源地址获取数据...")
-        response = requests.get(SOURCE_URL, timeout=30)
-        response.raise_for_status()
+        headers = {}
+        etag = _load_etag()
+        if etag:
+            headers['If-None-Match'] = etag
         
-        response.encoding = response.apparent_encoding or 'utf-8'
-        content = response.text
-        lines = content.splitlines()
+        with _SESSION.get(SOURCE_URL, headers=headers, stream=True, timeout=30) as response:
+            if response.status_code == 304:
+                return NOT_MODIFIED, etag
+            response.raise_for_status()
+            etag = response.headers.get('ETag')
+            
+            # 直接保留原始字节：过滤只看 ASCII 前缀，不需要解码成文本
+            # 分块追加到同一个 bytearray，避免先攒分块列表再 join 出第二份完整副本
+            content = bytearray()
+            for chunk in response.iter_content(chunk_size=65536):
+                content.extend(chunk)
         
-        logger.info(f"✅ 获取成功！共 {len(lines)} 行数据")
+        # 整段文本一次 findall 取出各行协议部分，只需对不同的取值做归一化
+        protocols = Counter()
+        for (scheme, key), count in Counter(_SCHEME_RE.findall(content)).items():
+            protocols[scheme.lower() if scheme else key.strip().lower()] += count
+        
+        logger.info(f"✅ 获取成功！共 {_count_lines(content)} 行数据")
         
         # 显示数据格式分析
         logger.info("📋 数据格式分析:")
-        protocols = {}
-        for line in lines:
-            if line.strip():
-                # 提取协议部分
-                if '://' in line:
-                    protocol = line.split('://')[0].lower()
-                elif '=' in line:
-                    protocol = line.split('=')[0].strip().lower()
-                else:
-                    continue
-                
-                protocols[protocol] = protocols.get(protocol, 0) + 1
-        
         for protocol, count in sorted(protocols.items()):
-            logger.info(f"  {protocol}: {count} 个")
+            logger.info("  %s: %d 个", protocol.decode('utf-8', 'replace'), count)
         
-        return content
+        return content, etag
     except Exception as e:
         logger.error(f"❌ 获取数据失败: {e}")
-        return None
+        return None, None
 
 def filter_nodes(content):
     """过滤节点，只移除 http=、https=、socks5= 开头的行"""
     if not content:
         return None
     
-    lines = content.splitlines()
-    filtered_lines = []
-    removed_count = 0
-    
-    # 要移除的协议（只有这三种格式使用 =）
-    remove_protocols = ['http=', 'https=', 'socks5=']
-    
     logger.info("🔍 开始过滤节点...")
     
-    for i, line in enumerate(lines):
-        line_stripped = line.strip()
-        
-        if not line_stripped:
-            filtered_lines.append(line)
-            continue
-        
-        # 检查是否是需要移除的协议（使用 = 格式）
-        should_remove = False
-        for protocol in remove_protocols:
-            if line_stripped.lower().startswith(protocol):
-                should_remove = True
-                removed_count += 1
-                
-                if removed_count <= 3:  # 只显示前3个被过滤的
-                    logger.debug(f"移除 {protocol}: {line_stripped[:60]}...")
-                break
-        
-        if should_remove:
-            continue
-        
-        # 保留所有其他行（包括标准格式 ss://, vmess:// 等）
-        filtered_lines.append(line)
+    # 单次正则替换移除 http=/https=/socks5= 行，保留所有其他行（包括 ss://, vmess:// 等）
+    filtered, removed_count = _FILTER_RE.subn(b'', content)
+    kept_count = _count_lines(filtered)
     
     logger.info(f"📊 过滤统计:")
-    logger.info(f"  原始行数: {len(lines)}")
+    logger.info(f"  原始行数: {kept_count + removed_count}")
     logger.info(f"  移除行数: {removed_count} (http=/https=/socks5=)")
-    logger.info(f"  保留行数: {len(filtered_lines)}")
+    logger.info(f"  保留行数: {kept_count}")
     
     # 分析保留的节点格式
-    analyze_preserved_nodes(filtered_lines)
+    analyze_preserved_nodes(filtered)
     
-    return '\n'.join(filtered_lines)
+    return filtered
 
-def analyze_preserved_nodes(lines):
+def analyze_preserved_nodes(content):
     """分析保留的节点类型"""
     standard_protocols = {
         'ss://': 0,
@@ -121,102 +153,92 @@ def analyze_preserved_nodes(lines):
         '其他格式': 0
     }
     
-    for line in lines:
-        line_stripped = line.strip()
-        if not line_stripped:
-            continue
-        
-        line_lower = line_stripped.lower()
-        
-        # 检查标准格式
-        found = False
-        for protocol in standard_protocols:
-            if line_lower.startswith(protocol):
-                standard_protocols[protocol] += 1
-                found = True
-                break
-        
-        if not found:
-            standard_protocols['其他格式'] += 1
+    # 检查标准格式：整段文本一次扫描，未捕获协议名的非空行归入其他格式
+    for protocol, count in Counter(_PROTO_RE.findall(content)).items():
+        if protocol:
+            standard_protocols[protocol.lower().decode('ascii') + '://'] += count
+        else:
+            standard_protocols['其他格式'] += count
     
     logger.info("📋 保留节点格式分析:")
     total_preserved = sum(standard_protocols.values())
     for protocol, count in standard_protocols.items():
         if count > 0:
             percentage = count / total_preserved * 100 if total_preserved > 0 else 0
-            logger.info(f"  {protocol}: {count} 个 ({percentage:.1f}%)")
+            logger.info("  %s: %d 个 (%.1f%%)", protocol, count, percentage)
     
     # 显示保留的节点示例
     logger.info("📝 保留节点示例 (前5个):")
-    example_count = 0
-    for line in lines:
-        line_stripped = line.strip()
-        if line_stripped and example_count < 5:
-            logger.info(f"  {line_stripped[:80]}...")
-            example_count += 1
-
-def save_result(content):
-    """保存过滤后的结果到文件"""
+    nonblank_lines = (line for line in io.BytesIO(content) if not line.isspace())
+    for line in itertools.islice(nonblank_lines, 5):
+        logger.info("  %.80s...", line.strip().decode('utf-8', 'replace'))
+
+def _file_digest(path):
+    """以 64 KB 分块流式计算文件的 BLAKE2b 摘要"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            h.update(chunk)
+    return h.digest()
+
+def _atomic_write(path, data):
+    """先写入临时文件并 fsync，再用 os.replace 原子替换，失败时保留原文件"""
+    tmp_path = path + '.tmp'
     try:
-        # 检查是否与现有内容相同
-        existing_content = ""
-        if os.path.exists(OUTPUT_FILE):
-            with open(OUTPUT_FILE, 'r', encoding='utf-8') as f:
-                existing_content = f.read()
-        
-        if content == existing_content:
+        with open(tmp_path, 'wb', buffering=1 << 20) as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _save_etag(etag):
+    """保存上游 ETag，供下次条件请求使用"""
+    if not etag:
+        if os.path.exists(ETAG_FILE):
+            os.remove(ETAG_FILE)
+        return
+    _atomic_write(ETAG_FILE, etag.encode('utf-8'))
+
+def save_result(content, etag=None):
+    """保存过滤后的结果到文件，并记录其对应的上游 ETag"""
+    try:
+        # 检查是否与现有内容相同：大小不同必然有变化，否则比较摘要
+        if (os.path.exists(OUTPUT_FILE)
+                and os.path.getsize(OUTPUT_FILE) == len(content)
+                and _file_digest(OUTPUT_FILE) == hashlib.blake2b(content, digest_size=16).digest()):
             logger.info("📌 内容无变化，无需更新文件")
+            _save_etag(etag)
             return False
         
-        # 写入新内容
-        with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-            f.write(content)
+        # 写入新内容（内容本身就是字节，无需再次编码）
+        _atomic_write(OUTPUT_FILE, content)
+        _save_etag(etag)
         
-        file_size = os.path.getsize(OUTPUT_FILE)
+        file_size = len(content)
         logger.info(f"✅ 结果已保存到 {OUTPUT_FILE}")
         logger.info(f"📏 文件大小: {file_size} 字节")
-        logger.info(f"📄 文件行数: {len(content.splitlines())}")
+        logger.info(f"📄 文件行数: {_count_lines(content)}")
         
         return True
     except Exception as e:
         logger.error(f"❌ 保存文件失败: {e}")
         return False
 
-def verify_result():
-    """验证过滤结果"""
-    try:
-        if not os.path.exists(OUTPUT_FILE):
-            logger.error("输出文件不存在")
-            return False
-        
-        with open(OUTPUT_FILE, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        lines = content.splitlines()
-        
-        # 检查是否还有需要移除的内容
-        bad_lines = []
-        for line in lines:
-            line_stripped = line.strip()
-            if line_stripped:
-                line_lower = line_stripped.lower()
-                if (line_lower.startswith('http=') or 
-                    line_lower.startswith('https=') or 
-                    line_lower.startswith('socks5=')):
-                    bad_lines.append(line)
-        
-        if not bad_lines:
-            logger.info("✅ 验证通过：无 http=/https=/socks5= 节点")
-            return True
-        else:
-            logger.warning(f"⚠️  发现 {len(bad_lines)} 个未过滤的节点:")
-            for bad_line in bad_lines[:3]:  # 只显示前3个
-                logger.warning(f"  - {bad_line[:60]}...")
-            return False
-            
-    except Exception as e:
-        logger.error(f"验证失败: {e}")
-        return False
+def verify_result(content):
+    """验证过滤结果（直接检查内存中的过滤结果，无需重新读取文件）"""
+    # 遇到第一个残留节点即停止扫描
+    bad_match = _FILTER_RE.search(content)
+    if bad_match is None:
+        logger.info("✅ 验证通过：无 http=/https=/socks5= 节点")
+        return True
+    
+    bad_line = bad_match.group().strip().decode('utf-8', 'replace')
+    logger.warning("⚠️  发现未过滤的节点: %.60s...", bad_line)
+    return False
 
 def main():
     """主函数"""
@@ -226,23 +248,27 @@ def main():
     logger.info("=" * 60)
     
     # 1. 获取数据
-    raw_content = fetch_nodes()
+    raw_content, etag = fetch_nodes()
+    if raw_content is NOT_MODIFIED:
+        logger.info("📌 上游内容未变化 (304 Not Modified)，跳过过滤")
+        return True
     if not raw_content:
         logger.error("无法获取数据，程序终止")
         return False
     
     # 2. 过滤节点
     filtered_content = filter_nodes(raw_content)
-    if not filtered_content:
+    # 过滤后只剩空行时同样视为失败，避免用空文件覆盖现有结果
+    if not filtered_content or filtered_content.isspace():
         logger.error("过滤失败")
         return False
     
     # 3. 保存结果
-    if not save_result(filtered_content):
+    if not save_result(filtered_content, etag):
         logger.info("没有新内容更新")
     
     # 4. 验证结果
-    verify_result()
+    verify_result(filtered_content)
     
     logger.info("=" * 60)
     logger.info("🎉 任务执行完成")